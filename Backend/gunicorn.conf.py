@@ -0,0 +1,19 @@
+import os
+import multiprocessing
+from dotenv import load_dotenv
+
+# Production entrypoint: gunicorn main:app -c gunicorn.conf.py
+# UvicornWorker uses uvloop and httptools automatically when they are installed (uvicorn[standard]).
+load_dotenv()
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn_worker.UvicornWorker"
+
+if os.getenv("REDIS_URL"):
+    workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+else:
+    # Without Redis, chat sessions and the availability cache live in process memory, and a request
+    # reaching another worker would silently start a new conversation, so only one worker can run
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    if workers > 1:
+        raise RuntimeError("WEB_CONCURRENCY is above 1 but REDIS_URL is not set; set REDIS_URL to run several workers.")
@@ -1,13 +1,17 @@
 import os
-import json
-from fastapi import FastAPI, HTTPException
+import orjson
+import asyncio
+import secrets
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, APIStatusError
+import httpx
 from datetime import datetime
 import tools
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 # --- INITIALIZATION ---
 load_dotenv()
@@ -20,11 +24,17 @@ app.add_middleware(
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
 )
 
-# OpenAI client
-client = OpenAI(
+# OpenAI client (async, with a shared connection pool so concurrent chats don't block each other).
+# HTTP/2 multiplexes concurrent requests over one TLS connection, kept alive between chats.
+client = AsyncOpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=os.getenv("OPENROUTER_API_KEY"),
     default_headers={"HTTP-Referer": os.getenv("OPENROUTER_SITE_NAME")},
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=300),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    ),
 )
 
 # --- UPDATED DATA MODELS ---
@@ -33,112 +43,448 @@ class Message(BaseModel):
     text: str
 
 class ChatRequest(BaseModel):
-    messages: List[Dict[str, str]]
-    session_id: str
+    # Issued by the server on the first turn; omit it to start a new conversation
+    session_id: Optional[str] = None
+    new_message: str
+
+class BatchConversation(BaseModel):
+    custom_id: str
+    messages: List[dict]
+
+class BatchRequest(BaseModel):
+    conversations: List[BatchConversation]
+
+# --- SESSIONS ---
+# Conversation history is kept server-side per session, so each request only carries the new message.
+# Session ids are random tokens issued by the server (histories hold names and emails), and an
+# unknown id starts a fresh session rather than being adopted.
+# With REDIS_URL set, sessions live in Redis and are shared by every worker process; otherwise they
+# are held in this process's memory, which only works with a single worker.
+MAX_SESSIONS = 1000
+MAX_HISTORY_MESSAGES = 40
+SESSION_TTL_SECONDS = 24 * 60 * 60
+SESSIONS: Dict[str, List[dict]] = {}
+redis_client = tools.get_redis()
+
+def get_session(session_id: str) -> Optional[List[dict]]:
+    history = SESSIONS.pop(session_id, None)
+    if history is not None:
+        # Re-insert to mark it most recently used
+        SESSIONS[session_id] = history
+    return history
+
+async def load_session(session_id: str) -> Optional[List[dict]]:
+    if redis_client:
+        raw = await redis_client.get(f"session:{session_id}")
+        return orjson.loads(raw) if raw else None
+    return get_session(session_id)
+
+async def open_session(session_id: Optional[str]) -> Tuple[str, List[dict]]:
+    """Returns the id and history of an existing session, or a new session with a fresh id."""
+    if session_id:
+        history = await load_session(session_id)
+        if history is not None:
+            return session_id, history
+    session_id, history = secrets.token_urlsafe(32), []
+    if not redis_client:
+        if len(SESSIONS) >= MAX_SESSIONS:
+            # Evict the least recently used session (dicts keep insertion order)
+            SESSIONS.pop(next(iter(SESSIONS)))
+        SESSIONS[session_id] = history
+    return session_id, history
+
+async def save_session(session_id: str, history: List[dict]):
+    # In-memory histories are updated in place, so only Redis needs an explicit write
+    if redis_client:
+        await redis_client.set(f"session:{session_id}", orjson.dumps(history), ex=SESSION_TTL_SECONDS)
+
+def trim_history(history: List[dict]):
+    # Sliding window; always start on a user message so a tool result never loses its tool call
+    if len(history) > MAX_HISTORY_MESSAGES:
+        del history[:len(history) - MAX_HISTORY_MESSAGES]
+        while history and history[0]["role"] != "user":
+            del history[0]
+
+def drop_unanswered_turn(history: List[dict]):
+    # A failed turn leaves the user's message without a reply; it is dropped so the next attempt
+    # doesn't send the model a run of consecutive user messages
+    if history and history[-1]["role"] == "user":
+        history.pop()
+
+# Sent when the model answers with nothing usable (an empty completion or a call to an unknown tool)
+FALLBACK_REPLY_TEXT = "Sorry, I didn't catch that. Could you rephrase your request?"
+
+def record_reply(history: List[dict], reply: dict, preamble: str = None) -> dict:
+    if preamble:
+        history.append({"role": "assistant", "content": preamble})
+    history.append({"role": "assistant", "content": reply["text"]})
+    return reply
+
+# --- SYSTEM PROMPT ---
+SYSTEM_PROMPT = """
+You are Schedura AI, a friendly and efficient booking assistant for {business_name}.
+Your primary goal is to help users book appointments. Use the conversation history for context.
+
+--- CRITICAL FLOW ---
+1. Greet the user and ask how you can help.
+2. If the user asks to see services, use the `get_available_services` tool.
+3. **After the user selects a service, DO NOT offer the services again.** Your next step is to ask for the desired date.
+4. After getting a date, use the `get_available_slots` tool.
+5. After the user selects a slot and provides their details (name, email), use the `book_appointment` tool.
+6. If you are missing information (like name or email), ask for it. Do not re-ask for information already in the chat history.
+
+--- CONTEXT ---
+- Today’s date is {today}.
+"""
+
+# The rendered prompt only changes when the date rolls over or the business name is edited
+_today_cache = {"date": "", "day": -1}
+_prompt_cache = {"key": None, "prompt": ""}
+
+def today_str() -> str:
+    now = datetime.now(tools.get_local_tz())
+    if now.toordinal() != _today_cache["day"]:
+        _today_cache["date"] = now.strftime('%Y-%m-%d')
+        _today_cache["day"] = now.toordinal()
+    return _today_cache["date"]
+
+def get_system_prompt() -> str:
+    key = (tools.get_config().get("business_name", "your business"), today_str())
+    if key != _prompt_cache["key"]:
+        _prompt_cache["prompt"] = SYSTEM_PROMPT.format(business_name=key[0], today=key[1])
+        _prompt_cache["key"] = key
+    return _prompt_cache["prompt"]
+
+# --- BACKGROUND WORKERS ---
+@app.on_event("startup")
+async def start_background_workers():
+    app.state.sheet_writer = asyncio.create_task(tools.sheet_writer())
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    # Let the writer flush any rows still queued before the process exits
+    tools.stop_sheet_writer()
+    await app.state.sheet_writer
+    await tools.close_smtp()
+    await tools.close_calendar_http()
+    await tools.close_redis()
+
+# --- STREAMING HELPERS ---
+def sse(payload: dict) -> str:
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+def add_tool_fragments(tool_calls: dict, fragments):
+    # Tool calls arrive in pieces keyed by index; names and arguments are concatenated
+    for fragment in fragments:
+        call = tool_calls.setdefault(fragment.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+        if fragment.id:
+            call["id"] = fragment.id
+        if fragment.function and fragment.function.name:
+            call["function"]["name"] += fragment.function.name
+        if fragment.function and fragment.function.arguments:
+            call["function"]["arguments"] += fragment.function.arguments
+
+async def read_until_text_or_tools(stream):
+    """
+    Consumes a streamed completion until it is clear whether the model is replying
+    with text or calling tools. Returns (tool_calls, None) once every tool call
+    fragment has been accumulated, or (None, first_text) with the stream left
+    positioned just after the first text delta. A text reply may still end in a
+    tool call; `event_source` picks that up.
+    """
+    tool_calls = {}
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.tool_calls:
+            add_tool_fragments(tool_calls, delta.tool_calls)
+        elif delta.content and not tool_calls:
+            return None, delta.content
+    return [tool_calls[i] for i in sorted(tool_calls)], None
+
+async def event_source(stream, session_id, history, first_text=None, on_tool_call=None):
+    """
+    Yields the text deltas of a streamed completion as SSE events (after a first
+    event carrying the session id) and records the full reply in the session history.
+    If the model follows its text with a tool call, `on_tool_call(tool_call, text)`
+    runs it once the stream ends: a reply dict is sent as a single `reply` event,
+    a follow-up completion is streamed on.
+    """
+    parts = [first_text] if first_text else []
+    tool_calls = {}
+    try:
+        yield sse({"session_id": session_id})
+        if first_text:
+            yield sse({"delta": first_text})
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.tool_calls:
+                add_tool_fragments(tool_calls, delta.tool_calls)
+            if delta.content:
+                parts.append(delta.content)
+                yield sse({"delta": delta.content})
+
+        if tool_calls and on_tool_call:
+            # The text so far becomes the content of the tool-calling assistant message
+            preamble, parts = "".join(parts), []
+            result = await on_tool_call(tool_calls[min(tool_calls)], preamble)
+            if result is None:
+                result = record_reply(history, {"type": "text", "text": FALLBACK_REPLY_TEXT}, preamble)
+            if isinstance(result, dict):
+                yield sse({"reply": result})
+            else:
+                yield sse({"delta": "\n\n"})
+                async for chunk in result:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield sse({"delta": chunk.choices[0].delta.content})
+    except Exception as e:
+        # The response has already started, so the error can only be reported in-stream
+        print(f"[ERROR] Chat stream failed: {e}")
+        yield sse({"error": str(e)})
+    finally:
+        if parts:
+            history.append({"role": "assistant", "content": "".join(parts)})
+        drop_unanswered_turn(history)
+        await save_session(session_id, history)
+
+# --- TOOL SCHEMA ---
+# Sent with every completion request; constant, so it is built once.
+TOOLS_SCHEMA = [
+    {
+        "type": "function", 
+        "function": {
+            "name": "get_available_services", 
+            # --- 2. REFINED TOOL DESCRIPTION ---
+            "description": "Use this tool ONLY when the user asks to see a list of all available services. Do NOT use it if they select a specific service to book.",
+            "parameters": { "type": "object", "properties": {} }
+        }
+    },
+    {
+        "type": "function", 
+        "function": {
+            "name": "get_available_slots", 
+            "description": "Find available appointment slots for a given date.", 
+            "parameters": {"type": "object", "properties": {"date_str": {"type": "string", "description": "The date to check, in YYYY-MM-DD format."}}}
+        }
+    },
+    {
+        "type": "function", 
+        "function": {
+            "name": "book_appointment", 
+            "description": "Book a service for a user once all details (service, date, time, name, email) are confirmed.", 
+            "parameters": {"type": "object", "properties": {"service_name": {"type": "string"}, "date_str": {"type": "string"}, "time_str": {"type": "string"}, "user_name": {"type": "string"}, "user_email": {"type": "string"}}}
+        }
+    }
+]
 
 # --- TOOL MAPPING ---
 AVAILABLE_TOOLS = {
     "get_available_services": tools.get_available_services,
     "get_available_slots": tools.get_available_slots,
-    "book_appointment": tools.book_appointment,
+    "book_appointment": tools.create_calendar_event,
 }
 
+# --- TOOL EXECUTION ---
+async def run_tool_call(tool_call: dict, history: List[dict], messages_for_llm: List[dict], background_tasks: BackgroundTasks, preamble: str = None):
+    """
+    Runs one tool call from the model. Returns a reply dict for the client, a streamed
+    follow-up completion (after booking), or None for an unknown tool. `preamble` is
+    any text the model wrote before calling the tool. Updates `history` but does not save it.
+    """
+    function_name = tool_call["function"]["name"]
+    args = orjson.loads(tool_call["function"]["arguments"] or "{}")
+
+    if function_name == "get_available_services":
+        services = tools.get_available_services()
+        return record_reply(history, {"type": "service_options", "text": "Of course! Here are the services we offer:", "data": services}, preamble)
+    
+    if function_name == "get_available_slots":
+        date_str = args.get("date_str")
+        if not date_str:
+            return record_reply(history, {"type": "date_request", "text": "Perfect. Now, please pick a date for your appointment."}, preamble)
+        
+        slots = await tools.get_available_slots(date_str)
+        if slots:
+            return record_reply(history, {"type": "slot_options", "text": f"Here are the available slots for {date_str}:", "data": slots}, preamble)
+        else:
+            return record_reply(history, {"type": "text", "text": f"Sorry, no slots are available on {date_str}. Please try another date."}, preamble)
+    
+    if function_name == "book_appointment":
+        # The calendar insert must finish first (its result is the confirmation text),
+        # but the sheet row is only queued and the email is sent after the response.
+        try:
+            confirmation_message = await tools.create_calendar_event(**args)
+            tools.log_to_sheet(**args)
+            background_tasks.add_task(
+                tools.send_confirmation_email, args["user_email"], args["user_name"], args["service_name"], args["date_str"], args["time_str"]
+            )
+        except Exception as e:
+            confirmation_message = f"Error booking appointment: {e}"
+        tool_turn = [
+            {"role": "assistant", "content": preamble or None, "tool_calls": [tool_call]},
+            {"tool_call_id": tool_call["id"], "role": "tool", "name": function_name, "content": confirmation_message},
+        ]
+        history.extend(tool_turn)
+        messages_for_llm.extend(tool_turn)
+
+        return await client.chat.completions.create(model="x-ai/grok-4-fast:free", messages=messages_for_llm, stream=True)
+
+    return None
+
 # --- UPDATED API ENDPOINT ---
 @app.post("/chat")
-async def chat(request: ChatRequest):
-    conversation_history = request.messages
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
+    session_id, history = await open_session(request.session_id)
+    history.append({"role": "user", "content": request.new_message})
+    trim_history(history)
     
     try:
-        with open('config.json', 'r') as f: config = json.load(f)
-        business_name = config.get("business_name", "your business")
-
-        # --- 1. IMPROVED SYSTEM PROMPT ---
-        system_prompt = f"""
-        You are Schedura AI, a friendly and efficient booking assistant for {business_name}.
-        Your primary goal is to help users book appointments. Use the conversation history for context.
-
-        --- CRITICAL FLOW ---
-        1. Greet the user and ask how you can help.
-        2. If the user asks to see services, use the `get_available_services` tool.
-        3. **After the user selects a service, DO NOT offer the services again.** Your next step is to ask for the desired date.
-        4. After getting a date, use the `get_available_slots` tool.
-        5. After the user selects a slot and provides their details (name, email), use the `book_appointment` tool.
-        6. If you are missing information (like name or email), ask for it. Do not re-ask for information already in the chat history.
-
-        --- CONTEXT ---
-        - Today’s date is {datetime.now().strftime('%Y-%m-%d')}.
-        """
-
-        messages_for_llm = [{"role": "system", "content": system_prompt}]
-        for msg in conversation_history:
-            role = "user" if msg['sender'] == 'user' else "assistant"
-            messages_for_llm.append({"role": role, "content": msg['text']})
-
-        response = client.chat.completions.create(
+        messages_for_llm = [{"role": "system", "content": get_system_prompt()}, *history]
+
+        response = await client.chat.completions.create(
             model="x-ai/grok-4-fast:free",
             messages=messages_for_llm,
-            tools=[
-                {
-                    "type": "function", 
-                    "function": {
-                        "name": "get_available_services", 
-                        # --- 2. REFINED TOOL DESCRIPTION ---
-                        "description": "Use this tool ONLY when the user asks to see a list of all available services. Do NOT use it if they select a specific service to book.",
-                        "parameters": { "type": "object", "properties": {} }
-                    }
-                },
-                {
-                    "type": "function", 
-                    "function": {
-                        "name": "get_available_slots", 
-                        "description": "Find available appointment slots for a given date.", 
-                        "parameters": {"type": "object", "properties": {"date_str": {"type": "string", "description": "The date to check, in YYYY-MM-DD format."}}}
-                    }
-                },
-                {
-                    "type": "function", 
-                    "function": {
-                        "name": "book_appointment", 
-                        "description": "Book a service for a user once all details (service, date, time, name, email) are confirmed.", 
-                        "parameters": {"type": "object", "properties": {"service_name": {"type": "string"}, "date_str": {"type": "string"}, "time_str": {"type": "string"}, "user_name": {"type": "string"}, "user_email": {"type": "string"}}}
-                    }
-                }
-            ],
-            tool_choice="auto"
+            tools=TOOLS_SCHEMA,
+            tool_choice="auto",
+            stream=True
+        )
+        # Text replies are streamed straight through; tool calls need their full arguments first
+        tool_calls, first_text = await read_until_text_or_tools(response)
+
+        async def on_tool_call(tool_call, preamble):
+            return await run_tool_call(tool_call, history, messages_for_llm, background_tasks, preamble)
+
+        if first_text is None:
+            # The stream is used up, so whatever the reply is has to come from here
+            result = await on_tool_call(tool_calls[0], None) if tool_calls else None
+            if result is None:
+                result = record_reply(history, {"type": "text", "text": FALLBACK_REPLY_TEXT})
+            if isinstance(result, dict):
+                await save_session(session_id, history)
+                return {**result, "session_id": session_id}
+            return StreamingResponse(event_source(result, session_id, history), media_type="text/event-stream")
+
+        return StreamingResponse(
+            event_source(response, session_id, history, first_text=first_text, on_tool_call=on_tool_call),
+            media_type="text/event-stream",
         )
-        response_message = response.choices[0].message
-        tool_calls = response_message.tool_calls
-
-        if tool_calls:
-            tool_call = tool_calls[0]
-            function_name = tool_call.function.name
-            args = json.loads(tool_call.function.arguments)
-
-            if function_name == "get_available_services":
-                services = tools.get_available_services()
-                return {"type": "service_options", "text": "Of course! Here are the services we offer:", "data": services}
-            
-            if function_name == "get_available_slots":
-                date_str = args.get("date_str")
-                if not date_str:
-                    return {"type": "date_request", "text": "Perfect. Now, please pick a date for your appointment."}
-                
-                slots = tools.get_available_slots(date_str)
-                if slots:
-                    return {"type": "slot_options", "text": f"Here are the available slots for {date_str}:", "data": slots}
-                else:
-                    return {"type": "text", "text": f"Sorry, no slots are available on {date_str}. Please try another date."}
-            
-            if function_name == "book_appointment":
-                messages_for_llm.append(response_message)
-                confirmation_message = tools.book_appointment(**args)
-                messages_for_llm.append({"tool_call_id": tool_call.id, "role": "tool", "name": function_name, "content": confirmation_message})
-
-                final_response = client.chat.completions.create(model="x-ai/grok-4-fast:free", messages=messages_for_llm)
-                return {"type": "text", "text": final_response.choices[0].message.content}
-
-        return {"type": "text", "text": response_message.content}
 
     except Exception as e:
         print(f"[ERROR] Chat endpoint failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        drop_unanswered_turn(history)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- OFFLINE BATCHES ---
+# Bulk, non-interactive replays (analytics, prompt regression checks) go through OpenAI's Batch API,
+# which is cheaper and has higher rate limits. OpenRouter has no Batch API, so these use OpenAI directly.
+BATCH_MODEL = os.getenv("BATCH_MODEL", "gpt-4o-mini")
+BATCH_POLL_SECONDS = 60
+BATCH_POLL_MAX_ERRORS = 5
+BATCH_RESULTS_DIR = "batch_results"
+_batch_client = {"client": None}
+_batch_pollers = set()
+
+def get_batch_client() -> AsyncOpenAI:
+    # Built lazily so the chat endpoint doesn't require OPENAI_API_KEY
+    if _batch_client["client"] is None:
+        _batch_client["client"] = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _batch_client["client"]
+
+def require_admin(admin_token):
+    expected = os.getenv("ADMIN_TOKEN")
+    # Constant-time comparison, so response timing doesn't reveal how much of a guess matched
+    if not expected or not secrets.compare_digest((admin_token or "").encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
+async def submit_batch(jsonl: bytes) -> str:
+    batch_client = get_batch_client()
+    input_file = await batch_client.files.create(file=("batch_input.jsonl", jsonl), purpose="batch")
+    batch = await batch_client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    return batch.id
+
+async def save_batch_results(batch) -> dict:
+    """
+    Downloads a completed batch's output and error files into BATCH_RESULTS_DIR, skipping any already saved.
+    Returns the paths of the files the batch has, as {"results_file": ..., "errors_file": ...}.
+    """
+    batch_client = get_batch_client()
+    os.makedirs(BATCH_RESULTS_DIR, exist_ok=True)
+    saved = {}
+    for key, file_id, suffix in (("results_file", batch.output_file_id, ".jsonl"), ("errors_file", batch.error_file_id, ".errors.jsonl")):
+        if not file_id:
+            continue
+        path = os.path.join(BATCH_RESULTS_DIR, f"{batch.id}{suffix}")
+        if not os.path.exists(path):
+            content = await batch_client.files.content(file_id)
+            # Written under a temporary name so an interrupted download isn't mistaken for a saved file
+            with open(f"{path}.part", "wb") as f:
+                f.write(content.content)
+            os.replace(f"{path}.part", path)
+        saved[key] = path
+    return saved
+
+async def poll_batch(batch_id: str):
+    batch_client = get_batch_client()
+    errors = 0
+    while True:
+        await asyncio.sleep(BATCH_POLL_SECONDS)
+        try:
+            batch = await batch_client.batches.retrieve(batch_id)
+            errors = 0
+            if batch.status == "completed":
+                await save_batch_results(batch)
+                return
+            if batch.status in ("failed", "expired", "cancelled"):
+                print(f"[ERROR] Batch {batch_id} ended with status {batch.status}")
+                return
+        except Exception as e:
+            errors += 1
+            print(f"[ERROR] Polling batch {batch_id} failed: {e}")
+            # Client errors other than rate limiting (unknown batch, bad key) won't go away by retrying
+            retryable = not isinstance(e, APIStatusError) or e.status_code == 429 or e.status_code >= 500
+            if not retryable or errors >= BATCH_POLL_MAX_ERRORS:
+                print(f"[ERROR] Stopped polling batch {batch_id}; its results can still be fetched from /chat/batch/{batch_id}")
+                return
+
+@app.post("/chat/batch")
+async def chat_batch(request: BatchRequest, x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    system_message = {"role": "system", "content": get_system_prompt()}
+    lines = [
+        orjson.dumps({
+            "custom_id": conversation.custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": BATCH_MODEL, "messages": [system_message, *conversation.messages], "tools": TOOLS_SCHEMA},
+        })
+        for conversation in request.conversations
+    ]
+    try:
+        batch_id = await submit_batch(b"\n".join(lines))
+    except Exception as e:
+        print(f"[ERROR] Batch submission failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Keep a reference so the poller isn't garbage collected while it runs
+    poller = asyncio.create_task(poll_batch(batch_id))
+    _batch_pollers.add(poller)
+    poller.add_done_callback(_batch_pollers.discard)
+    return {"batch_id": batch_id, "status": "submitted"}
+
+@app.get("/chat/batch/{batch_id}")
+async def chat_batch_status(batch_id: str, x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    try:
+        batch = await get_batch_client().batches.retrieve(batch_id)
+        result = {"batch_id": batch.id, "status": batch.status}
+        if batch.status == "completed":
+            # Only downloads files not saved yet, which covers batches whose poller was lost to a restart
+            result.update(await save_batch_results(batch))
+        return result
+    except Exception as e:
+        print(f"[ERROR] Batch status check failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
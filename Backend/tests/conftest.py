@@ -0,0 +1,4 @@
+import os
+
+# main.py builds its OpenRouter client at import time, which needs a key to be set
+os.environ.setdefault("OPENROUTER_API_KEY", "test-key")
@@ -0,0 +1,211 @@
+import asyncio
+import warnings
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+from fastapi.testclient import TestClient
+
+import main
+
+
+# --- fake streamed completions ---
+def text_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text, tool_calls=None))])
+
+def tool_chunk(index, id=None, name=None, arguments=None):
+    fragment = SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None, tool_calls=[fragment]))])
+
+async def fake_stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+def collect_events(source):
+    async def run():
+        return [orjson.loads(event[len("data: "):]) async for event in source]
+    return asyncio.run(run())
+
+def use_fake_completions(monkeypatch, *streams):
+    """Makes each model call in main return the next of `streams`."""
+    pending = list(streams)
+
+    async def create(**kwargs):
+        return fake_stream(*pending.pop(0))
+
+    monkeypatch.setattr(main, "client", SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    monkeypatch.setattr(main, "get_system_prompt", lambda: "system prompt")
+
+
+# --- read_until_text_or_tools ---
+def test_read_until_text_or_tools_joins_tool_call_fragments():
+    stream = fake_stream(
+        tool_chunk(0, id="call_1", name="get_available_slots", arguments='{"date_'),
+        tool_chunk(0, arguments='str": "2024-05-14"}'),
+    )
+    tool_calls, first_text = asyncio.run(main.read_until_text_or_tools(stream))
+    assert first_text is None
+    assert tool_calls == [{"id": "call_1", "type": "function", "function": {"name": "get_available_slots", "arguments": '{"date_str": "2024-05-14"}'}}]
+
+def test_read_until_text_or_tools_stops_at_first_text():
+    async def run():
+        stream = fake_stream(text_chunk("Hello"), text_chunk(" there"))
+        result = await main.read_until_text_or_tools(stream)
+        # The rest of the reply is left on the stream for event_source
+        return result, [chunk.choices[0].delta.content async for chunk in stream]
+
+    assert asyncio.run(run()) == ((None, "Hello"), [" there"])
+
+def test_read_until_text_or_tools_empty_completion():
+    assert asyncio.run(main.read_until_text_or_tools(fake_stream())) == ([], None)
+
+
+# --- event_source ---
+def test_event_source_streams_text_and_records_it():
+    history = [{"role": "user", "content": "hi"}]
+    events = collect_events(main.event_source(fake_stream(text_chunk(" there")), "sid", history, first_text="Hello"))
+    assert events == [{"session_id": "sid"}, {"delta": "Hello"}, {"delta": " there"}]
+    assert history[-1] == {"role": "assistant", "content": "Hello there"}
+
+def test_event_source_runs_tool_call_after_text():
+    history = [{"role": "user", "content": "what do you offer?"}]
+    calls = []
+
+    async def on_tool_call(tool_call, preamble):
+        calls.append((tool_call["function"]["name"], preamble))
+        return main.record_reply(history, {"type": "service_options", "text": "Here you go:", "data": []}, preamble)
+
+    stream = fake_stream(tool_chunk(0, id="call_1", name="get_available_services", arguments="{}"))
+    events = collect_events(main.event_source(stream, "sid", history, first_text="Let me check.", on_tool_call=on_tool_call))
+    assert calls == [("get_available_services", "Let me check.")]
+    assert events[-1] == {"reply": {"type": "service_options", "text": "Here you go:", "data": []}}
+    assert [m["content"] for m in history[1:]] == ["Let me check.", "Here you go:"]
+
+def test_event_source_falls_back_when_tool_is_unknown():
+    history = [{"role": "user", "content": "hi"}]
+
+    async def on_tool_call(tool_call, preamble):
+        return None
+
+    stream = fake_stream(tool_chunk(0, id="call_1", name="no_such_tool", arguments="{}"))
+    events = collect_events(main.event_source(stream, "sid", history, first_text="Sure.", on_tool_call=on_tool_call))
+    assert events[-1] == {"reply": {"type": "text", "text": main.FALLBACK_REPLY_TEXT}}
+    assert [m["content"] for m in history[1:]] == ["Sure.", main.FALLBACK_REPLY_TEXT]
+
+def test_event_source_reports_stream_errors():
+    async def broken_stream():
+        yield text_chunk("Hel")
+        raise RuntimeError("connection reset")
+
+    history = [{"role": "user", "content": "hi"}]
+    events = collect_events(main.event_source(broken_stream(), "sid", history))
+    assert events[-1] == {"error": "connection reset"}
+    assert history[-1] == {"role": "assistant", "content": "Hel"}
+
+
+# --- /chat ---
+def chat(message, session_id=None):
+    return asyncio.run(main.chat(main.ChatRequest(session_id=session_id, new_message=message), BackgroundTasks()))
+
+def test_chat_falls_back_on_empty_completion(monkeypatch):
+    use_fake_completions(monkeypatch, [])
+    reply = chat("hi")
+    assert reply["text"] == main.FALLBACK_REPLY_TEXT
+    assert main.SESSIONS[reply["session_id"]][-1] == {"role": "assistant", "content": main.FALLBACK_REPLY_TEXT}
+
+def test_chat_falls_back_on_unknown_tool(monkeypatch):
+    use_fake_completions(monkeypatch, [tool_chunk(0, id="call_1", name="no_such_tool", arguments="{}")])
+    assert chat("hi")["text"] == main.FALLBACK_REPLY_TEXT
+
+def test_chat_returns_tool_reply_as_json(monkeypatch):
+    use_fake_completions(monkeypatch, [tool_chunk(0, id="call_1", name="get_available_slots", arguments="{}")])
+    reply = chat("I'd like to book")
+    assert reply["type"] == "date_request"
+    assert reply["session_id"] in main.SESSIONS
+
+
+# --- sessions ---
+def user(n):
+    return {"role": "user", "content": f"u{n}"}
+
+def assistant(n):
+    return {"role": "assistant", "content": f"a{n}"}
+
+def test_trim_history_keeps_short_history(monkeypatch):
+    monkeypatch.setattr(main, "MAX_HISTORY_MESSAGES", 4)
+    history = [user(1), assistant(1), user(2)]
+    main.trim_history(history)
+    assert history == [user(1), assistant(1), user(2)]
+
+def test_trim_history_keeps_latest_messages(monkeypatch):
+    monkeypatch.setattr(main, "MAX_HISTORY_MESSAGES", 4)
+    history = [user(1), assistant(1), user(2), assistant(2), user(3), assistant(3)]
+    main.trim_history(history)
+    assert history == [user(2), assistant(2), user(3), assistant(3)]
+
+def test_trim_history_starts_on_user_message(monkeypatch):
+    monkeypatch.setattr(main, "MAX_HISTORY_MESSAGES", 4)
+    tool_call = {"role": "assistant", "content": None, "tool_calls": [{"id": "call_1"}]}
+    tool_result = {"role": "tool", "tool_call_id": "call_1", "content": "[]"}
+    history = [user(1), tool_call, tool_result, assistant(1), user(2), assistant(2)]
+    main.trim_history(history)
+    # The window would begin on the tool result; it is dropped rather than kept without its call
+    assert history == [user(2), assistant(2)]
+
+
+def test_open_session_issues_random_ids():
+    first_id, first_history = asyncio.run(main.open_session(None))
+    second_id, _ = asyncio.run(main.open_session(None))
+    assert first_history == [] and first_id != second_id
+    assert len(first_id) >= 32
+
+def test_open_session_resumes_known_id():
+    session_id, history = asyncio.run(main.open_session(None))
+    history.append(user(1))
+    assert asyncio.run(main.open_session(session_id)) == (session_id, [user(1)])
+
+def test_open_session_replaces_unknown_id():
+    session_id, history = asyncio.run(main.open_session("session_1700000000000"))
+    assert session_id != "session_1700000000000" and history == []
+    assert "session_1700000000000" not in main.SESSIONS
+
+def test_open_session_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(main, "SESSIONS", {})
+    monkeypatch.setattr(main, "MAX_SESSIONS", 2)
+    oldest, _ = asyncio.run(main.open_session(None))
+    newer, _ = asyncio.run(main.open_session(None))
+    asyncio.run(main.open_session(oldest))  # touching it makes `newer` the least recently used
+    asyncio.run(main.open_session(None))
+    assert oldest in main.SESSIONS and newer not in main.SESSIONS
+
+def test_chat_failure_does_not_keep_user_message(monkeypatch):
+    use_fake_completions(monkeypatch, [text_chunk("Hi!")])
+    session_id = collect_events(chat("hello").body_iterator)[0]["session_id"]
+
+    async def failing_create(**kwargs):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(main.client.chat.completions, "create", failing_create)
+    for message in ("x", "y", "z"):
+        with pytest.raises(HTTPException):
+            chat(message, session_id)
+    assert main.SESSIONS[session_id] == [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "Hi!"}]
+
+def test_stream_failure_does_not_keep_user_message():
+    async def broken_stream():
+        raise RuntimeError("connection reset")
+        yield
+
+    history = [user(1), assistant(1), user(2)]
+    events = collect_events(main.event_source(broken_stream(), "sid", history))
+    assert events[-1] == {"error": "connection reset"}
+    assert history == [user(1), assistant(1)]
+
+def test_chat_json_reply_over_http(monkeypatch):
+    use_fake_completions(monkeypatch, [])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # e.g. FastAPIDeprecationWarning for a deprecated response class
+        response = TestClient(main.app).post("/chat", json={"new_message": "hi"})
+    assert response.status_code == 200
+    assert response.json()["text"] == main.FALLBACK_REPLY_TEXT
@@ -0,0 +1,269 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+import orjson
+import pytest
+from google.oauth2.credentials import Credentials
+
+import tools
+
+
+# --- iso_to_epoch ---
+def test_iso_to_epoch_utc():
+    assert tools.iso_to_epoch("2024-05-14T03:30:00Z") == int(datetime(2024, 5, 14, 3, 30, tzinfo=timezone.utc).timestamp())
+
+def test_iso_to_epoch_offsets_match_utc():
+    utc = tools.iso_to_epoch("2024-05-14T03:30:00Z")
+    assert tools.iso_to_epoch("2024-05-14T09:00:00+05:30") == utc
+    assert tools.iso_to_epoch("2024-05-13T23:30:00-04:00") == utc
+    assert tools.iso_to_epoch("2024-05-14T03:30:00+00:00") == utc
+
+def test_iso_to_epoch_fractional_seconds():
+    assert tools.iso_to_epoch("2024-05-14T03:30:00.123Z") == tools.iso_to_epoch("2024-05-14T03:30:00Z")
+    assert tools.iso_to_epoch("2024-05-14T09:00:00.5+05:30") == tools.iso_to_epoch("2024-05-14T03:30:00Z")
+
+
+# --- free_slot_starts ---
+HOUR = 3600
+SLOTS = np.arange(9 * HOUR, 17 * HOUR, HOUR, dtype=np.int64)  # 09:00 .. 16:00 starts
+
+def free_hours(busy):
+    busy_s = np.array([start for start, _ in busy], dtype=np.int64)
+    busy_e = np.array([end for _, end in busy], dtype=np.int64)
+    return (tools.free_slot_starts(SLOTS, busy_s, busy_e, HOUR) // HOUR).tolist()
+
+def test_free_slot_starts_no_busy():
+    assert free_hours([]) == list(range(9, 17))
+
+def test_free_slot_starts_partial_overlap_blocks_slot():
+    # 10:30-11:15 touches both the 10:00 and 11:00 slots
+    assert free_hours([(10 * HOUR + 1800, 11 * HOUR + 900)]) == [9, 12, 13, 14, 15, 16]
+
+def test_free_slot_starts_touching_edges_stay_free():
+    # A meeting ending at 10:00 and one starting at 12:00 leave 10:00 and 11:00 free
+    assert free_hours([(9 * HOUR, 10 * HOUR), (12 * HOUR, 13 * HOUR)]) == [10, 11, 13, 14, 15, 16]
+
+def test_free_slot_starts_interval_spanning_day():
+    assert free_hours([(8 * HOUR, 18 * HOUR)]) == []
+
+
+# --- sheet_writer ---
+def run_sheet_writer(monkeypatch, rows, batch_size):
+    batches = []
+
+    async def fake_write_batch(batch):
+        batches.append(batch)
+
+    async def run():
+        # A fresh queue and event per test, since each is tied to the event loop that first waits on it
+        monkeypatch.setattr(tools, "_sheet_queue", asyncio.Queue())
+        monkeypatch.setattr(tools, "_sheet_stopping", asyncio.Event())
+        for row in rows:
+            tools._sheet_queue.put_nowait(row)
+        tools.stop_sheet_writer()
+        await asyncio.wait_for(tools.sheet_writer(), timeout=5)
+
+    monkeypatch.setattr(tools, "_write_batch", fake_write_batch)
+    monkeypatch.setattr(tools, "SHEET_BATCH_SIZE", batch_size)
+    asyncio.run(run())
+    return batches
+
+def test_sheet_writer_splits_rows_into_batches(monkeypatch):
+    rows = [[i] for i in range(7)]
+    assert run_sheet_writer(monkeypatch, rows, batch_size=3) == [rows[0:3], rows[3:6], rows[6:7]]
+
+def test_sheet_writer_flushes_on_stop(monkeypatch):
+    assert run_sheet_writer(monkeypatch, [["a"], ["b"]], batch_size=50) == [[["a"], ["b"]]]
+
+def test_sheet_writer_flushes_after_timeout(monkeypatch):
+    batches = []
+
+    async def fake_write_batch(batch):
+        batches.append(batch)
+
+    async def run():
+        monkeypatch.setattr(tools, "_sheet_queue", asyncio.Queue())
+        monkeypatch.setattr(tools, "_sheet_stopping", asyncio.Event())
+        writer = asyncio.create_task(tools.sheet_writer())
+        tools.log_to_sheet("Haircut", "2024-05-14", "10:00", "Ada", "ada@example.com")
+        await asyncio.sleep(0.2)
+        written_before_stop = list(batches)
+        tools.stop_sheet_writer()
+        await asyncio.wait_for(writer, timeout=5)
+        return written_before_stop
+
+    monkeypatch.setattr(tools, "_write_batch", fake_write_batch)
+    monkeypatch.setattr(tools, "SHEET_FLUSH_SECONDS", 0.05)
+    written_before_stop = asyncio.run(run())
+    assert len(written_before_stop) == 1
+    assert written_before_stop[0][0][1:] == ["Ada", "ada@example.com", "Haircut", "2024-05-14", "10:00"]
+    assert batches == written_before_stop
+
+def run_write_batch(monkeypatch, failures, stopping=False):
+    attempts = []
+
+    async def flaky_append_rows(rows):
+        attempts.append(rows)
+        if len(attempts) <= failures:
+            raise RuntimeError("429 quota exceeded")
+
+    async def run():
+        monkeypatch.setattr(tools, "_sheet_stopping", asyncio.Event())
+        if stopping:
+            tools._sheet_stopping.set()
+        await tools._write_batch([["row"]])
+
+    monkeypatch.setattr(tools, "_append_rows", flaky_append_rows)
+    monkeypatch.setattr(tools, "SHEET_RETRY_BASE_SECONDS", 0)
+    asyncio.run(run())
+    return len(attempts)
+
+def test_write_batch_retries_then_succeeds(monkeypatch, capsys):
+    assert run_write_batch(monkeypatch, failures=2) == 3
+    assert "Dropped sheet row" not in capsys.readouterr().out
+
+def test_write_batch_logs_rows_after_last_attempt(monkeypatch, capsys):
+    assert run_write_batch(monkeypatch, failures=tools.SHEET_WRITE_ATTEMPTS) == tools.SHEET_WRITE_ATTEMPTS
+    assert '[ERROR] Dropped sheet row: ["row"]' in capsys.readouterr().out
+
+def test_write_batch_skips_backoff_when_stopping(monkeypatch, capsys):
+    assert run_write_batch(monkeypatch, failures=1, stopping=True) == 1
+    assert '[ERROR] Dropped sheet row: ["row"]' in capsys.readouterr().out
+
+def test_write_batch_cuts_backoff_short_on_stop(monkeypatch):
+    attempts = []
+
+    async def failing_append_rows(rows):
+        attempts.append(rows)
+        raise RuntimeError("429 quota exceeded")
+
+    async def run():
+        monkeypatch.setattr(tools, "_sheet_stopping", asyncio.Event())
+        writer = asyncio.create_task(tools._write_batch([["row"]]))
+        await asyncio.sleep(0.05)
+        tools._sheet_stopping.set()
+        await asyncio.wait_for(writer, timeout=5)
+
+    monkeypatch.setattr(tools, "_append_rows", failing_append_rows)
+    monkeypatch.setattr(tools, "SHEET_RETRY_BASE_SECONDS", 60)
+    asyncio.run(run())
+    # The first backoff is interrupted, leaving one final attempt before the rows are logged
+    assert len(attempts) == 2
+
+
+# --- availability cache ---
+CONFIG = {"timezone": "UTC", "business_hours": {"start": "09:00", "end": "12:00"}, "_services_by_name": {"haircut": {"name": "Haircut", "duration_minutes": 30}}}
+
+class FakeRedis:
+    def __init__(self, broken=False):
+        self.data, self.broken = {}, broken
+
+    def check(self):
+        if self.broken:
+            raise ConnectionError("redis down")
+
+    async def get(self, key):
+        self.check()
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.check()
+        self.data[key] = value
+
+    async def delete(self, key):
+        self.check()
+        self.data.pop(key, None)
+
+def use_fake_calendar(monkeypatch, redis_client, busy=()):
+    posts = []
+
+    async def fake_calendar_post(path, body):
+        posts.append(path)
+        if path == "freeBusy":
+            return {"calendars": {"primary": {"busy": list(busy)}}}
+        return {}
+
+    monkeypatch.setattr(tools, "calendar_post", fake_calendar_post)
+    monkeypatch.setattr(tools, "get_config", lambda: CONFIG)
+    monkeypatch.setattr(tools, "get_redis", lambda: redis_client)
+    monkeypatch.delenv("GOOGLE_CALENDAR_ID", raising=False)
+    return posts
+
+def test_slots_cached_in_redis_until_booking(monkeypatch):
+    redis_client = FakeRedis()
+    posts = use_fake_calendar(monkeypatch, redis_client, busy=[{"start": "2024-05-14T10:00:00Z", "end": "2024-05-14T11:00:00Z"}])
+    assert asyncio.run(tools.get_available_slots("2024-05-14")) == ["09:00", "11:00"]
+    assert asyncio.run(tools.get_available_slots("2024-05-14")) == ["09:00", "11:00"]
+    assert posts == ["freeBusy"]
+    asyncio.run(tools.create_calendar_event("Haircut", "2024-05-14", "09:00", "Ada", "ada@example.com"))
+    assert "slots:primary:2024-05-14" not in redis_client.data
+
+def test_slots_survive_cache_errors(monkeypatch):
+    posts = use_fake_calendar(monkeypatch, FakeRedis(broken=True))
+    assert asyncio.run(tools.get_available_slots("2024-05-14")) == ["09:00", "10:00", "11:00"]
+    assert asyncio.run(tools.create_calendar_event("Haircut", "2024-05-14", "09:00", "Ada", "ada@example.com")).startswith("Appointment confirmed")
+    assert posts == ["freeBusy", "calendars/primary/events"]
+
+
+# --- credentials ---
+class FakeCreds:
+    def __init__(self, token):
+        self.token, self.refresh_token, self.expiry, self.valid = token, "refresh-token", None, True
+        self.refreshes = 0
+
+    def refresh(self, request):
+        time.sleep(0.05)  # long enough for concurrent callers to pile up on the lock
+        self.refreshes += 1
+        self.token = f"token-{self.refreshes}"
+
+    def to_json(self):
+        return orjson.dumps({"token": self.token}).decode()
+
+def test_rejected_token_is_refreshed_once_across_threads(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    creds = FakeCreds("token-0")
+    monkeypatch.setitem(tools._clients, "creds", creds)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        tokens = list(pool.map(lambda _: tools.get_google_creds("token-0").token, range(4)))
+    assert creds.refreshes == 1
+    assert tokens == ["token-1"] * 4
+    assert orjson.loads((tmp_path / "token.json").read_bytes()) == {"token": "token-1"}
+
+def test_gspread_gets_its_own_copy_of_the_credentials(monkeypatch):
+    shared = Credentials(token="token-0", refresh_token="refresh-token", client_id="id", client_secret="secret", token_uri="https://oauth2.googleapis.com/token")
+    monkeypatch.setitem(tools._clients, "creds", shared)
+    copy = tools._gspread_creds()
+    assert copy is not shared
+    assert (copy.token, copy.refresh_token) == ("token-0", "refresh-token")
+
+def use_fake_calendar_http(monkeypatch, *statuses):
+    requests, pending = [], list(statuses)
+
+    class FakeHttp:
+        async def post(self, path, json, headers):
+            requests.append(headers["Authorization"])
+            return httpx.Response(pending.pop(0), json={"ok": True}, request=httpx.Request("POST", f"{tools.CALENDAR_API_URL}{path}"))
+
+    def fake_get_google_creds(rejected_token=None):
+        return SimpleNamespace(token="fresh" if rejected_token else "stale")
+
+    monkeypatch.setattr(tools, "_calendar_http", FakeHttp())
+    monkeypatch.setattr(tools, "get_google_creds", fake_get_google_creds)
+    monkeypatch.setitem(tools._clients, "creds", None)
+    return requests
+
+def test_calendar_post_retries_once_with_a_fresh_token_on_401(monkeypatch):
+    requests = use_fake_calendar_http(monkeypatch, 401, 200)
+    assert asyncio.run(tools.calendar_post("freeBusy", {})) == {"ok": True}
+    assert requests == ["Bearer stale", "Bearer fresh"]
+
+def test_calendar_post_gives_up_after_second_401(monkeypatch):
+    requests = use_fake_calendar_http(monkeypatch, 401, 401)
+    with pytest.raises(RuntimeError, match=r"\(401\)"):
+        asyncio.run(tools.calendar_post("freeBusy", {}))
+    assert len(requests) == 2
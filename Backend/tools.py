@@ -1,33 +1,202 @@
 import os
-import json
-import smtplib
+import orjson
+import asyncio
+import time
+import threading
+import calendar
+import httpx
+from urllib.parse import quote
+import aiosmtplib
 from email.mime.text import MIMEText
 from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-import gspread
-import pytz
+import gspread_asyncio
+import redis.asyncio as redis
+import numpy as np
 
 # --- CONFIGURATION & CONSTANTS ---
 SCOPES = ["https://www.googleapis.com/auth/calendar", "https://www.googleapis.com/auth/spreadsheets"]
 CONFIG_FILE = 'config.json'
+DEFAULT_TIMEZONE = "Asia/Kolkata"
+
+# --- CONFIG CACHE ---
+# Parsed once and reused; re-read only when config.json changes on disk.
+_CONFIG_CACHE = {"mtime": 0, "data": None}
+
+def get_config() -> dict:
+    mtime = os.stat(CONFIG_FILE).st_mtime
+    if _CONFIG_CACHE["data"] is None or mtime != _CONFIG_CACHE["mtime"]:
+        with open(CONFIG_FILE, 'rb') as f:
+            config = orjson.loads(f.read())
+        # Case-insensitive service lookup table, rebuilt only when the config changes
+        config["_services_by_name"] = {s["name"].casefold(): s for s in config.get("services", [])}
+        _CONFIG_CACHE["data"] = config
+        _CONFIG_CACHE["mtime"] = mtime
+    return _CONFIG_CACHE["data"]
+
+def get_local_tz() -> ZoneInfo:
+    # ZoneInfo caches instances per key, so repeated calls reuse the same object
+    return ZoneInfo(get_config().get("timezone", DEFAULT_TIMEZONE))
+
+# --- AVAILABILITY CACHE ---
+# Free slots per (calendar_id, date), reused for a short while and dropped when a booking is made
+# into that day. Edits made directly in the calendar show up once the entry expires.
+# With REDIS_URL set the cache lives in Redis, so a booking in one worker invalidates it for all of
+# them; otherwise it is per process (gunicorn.conf.py only allows one worker without Redis).
+SLOTS_CACHE_TTL_SECONDS = int(os.getenv("SLOTS_CACHE_TTL_SECONDS", "30"))
+_slots_cache = {}
+
+# --- SHEET WRITE QUEUE ---
+# Bookings are appended to the sheet in batches to stay clear of the Sheets API write quota.
+SHEET_BATCH_SIZE = 50
+SHEET_FLUSH_SECONDS = 2
+SHEET_WRITE_ATTEMPTS = 5
+SHEET_RETRY_BASE_SECONDS = 2
+_sheet_queue: asyncio.Queue = asyncio.Queue()
+_sheet_stopping = asyncio.Event()
 
 # --- AUTHENTICATION HELPER ---
-def get_google_creds():
-    creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-    return creds
+# Credentials and API clients are built once per process and reused across requests.
+_clients = {"creds": None, "gspread": None, "redis": None}
+# Loading and refreshing run on worker threads (asyncio.to_thread, gspread_asyncio), so they are
+# serialized to keep concurrent refreshes from interleaving their writes to token.json.
+# gspread gets its own copy of the credentials (see `_gspread_creds`), since it refreshes them itself.
+_creds_lock = threading.Lock()
+
+def _expires_soon(creds) -> bool:
+    # creds.expiry is a naive UTC datetime
+    return creds.expiry is not None and creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None) < timedelta(seconds=60)
+
+def _creds_usable(creds) -> bool:
+    return bool(creds and creds.valid and not _expires_soon(creds))
+
+def get_google_creds(rejected_token: str = None):
+    """
+    Returns cached credentials, loading or refreshing them when needed.
+    Pass the token an API call was refused with (HTTP 401) to force a refresh even if it hasn't expired yet.
+    """
+    creds = _clients["creds"]
+    if _creds_usable(creds) and creds.token != rejected_token:
+        return creds
+    with _creds_lock:
+        # Another thread may have refreshed while this one waited for the lock
+        creds = _clients["creds"]
+        if _creds_usable(creds) and creds.token != rejected_token:
+            return creds
+        if creds is None and os.path.exists("token.json"):
+            creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+        if not creds or not creds.valid or _expires_soon(creds) or creds.token == rejected_token:
+            try:
+                if not (creds and creds.refresh_token):
+                    raise RefreshError("No refresh token available.")
+                creds.refresh(Request())
+            except RefreshError:
+                flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+                creds = flow.run_local_server(port=0)
+                # Its copy still holds the refresh token that just failed
+                _clients["gspread"] = None
+            with open("token.json", "w") as token:
+                token.write(creds.to_json())
+        _clients["creds"] = creds
+        return creds
+
+# --- CALENDAR API ---
+# Only freeBusy.query and events.insert are used, so they are plain REST calls on a pooled
+# HTTP client rather than going through the discovery-based googleapiclient service.
+CALENDAR_API_URL = "https://www.googleapis.com/calendar/v3/"
+_calendar_http = httpx.AsyncClient(base_url=CALENDAR_API_URL, timeout=httpx.Timeout(30.0, connect=5.0))
+
+async def calendar_post(path: str, body: dict) -> dict:
+    creds = _clients["creds"]
+    if not _creds_usable(creds):
+        # Loading or refreshing the token does blocking I/O
+        creds = await asyncio.to_thread(get_google_creds)
+    response = await _calendar_http.post(path, json=body, headers={"Authorization": f"Bearer {creds.token}"})
+    if response.status_code == 401:
+        # The token was revoked or expired ahead of its recorded expiry; refresh it and retry once
+        creds = await asyncio.to_thread(get_google_creds, creds.token)
+        response = await _calendar_http.post(path, json=body, headers={"Authorization": f"Bearer {creds.token}"})
+    if response.is_error:
+        raise RuntimeError(f"Calendar API {path} failed ({response.status_code}): {response.text}")
+    return response.json()
+
+async def close_calendar_http():
+    await _calendar_http.aclose()
+
+def _gspread_creds() -> Credentials:
+    # gspread's AuthorizedSession refreshes the credentials it holds on its own executor threads,
+    # outside _creds_lock and without saving token.json, so it gets a separate copy of the shared ones
+    return Credentials.from_authorized_user_info(orjson.loads(get_google_creds().to_json()), SCOPES)
+
+def get_gspread_manager():
+    # The manager caches its authorized client and re-authorizes periodically on its own,
+    # taking a fresh copy of the credentials each time
+    if _clients["gspread"] is None:
+        _clients["gspread"] = gspread_asyncio.AsyncioGspreadClientManager(_gspread_creds)
+    return _clients["gspread"]
+
+# --- REDIS ---
+def get_redis():
+    # Created on first use: main.py loads .env (which may set REDIS_URL) after importing this module
+    if _clients["redis"] is None and os.getenv("REDIS_URL"):
+        _clients["redis"] = redis.from_url(os.environ["REDIS_URL"])
+    return _clients["redis"]
+
+async def close_redis():
+    if _clients["redis"] is not None:
+        await _clients["redis"].aclose()
+        _clients["redis"] = None
+
+async def _get_cached_slots(calendar_id: str, date_str: str):
+    redis_client = get_redis()
+    if redis_client:
+        raw = await redis_client.get(f"slots:{calendar_id}:{date_str}")
+        return orjson.loads(raw) if raw is not None else None
+    cached_at, cached_slots = _slots_cache.get((calendar_id, date_str), (0, None))
+    return cached_slots if time.time() - cached_at < SLOTS_CACHE_TTL_SECONDS else None
+
+async def _set_cached_slots(calendar_id: str, date_str: str, slots: list):
+    if SLOTS_CACHE_TTL_SECONDS <= 0:
+        return
+    redis_client = get_redis()
+    if redis_client:
+        await redis_client.set(f"slots:{calendar_id}:{date_str}", orjson.dumps(slots), ex=SLOTS_CACHE_TTL_SECONDS)
+    else:
+        _slots_cache[(calendar_id, date_str)] = (time.time(), slots)
+
+async def _drop_cached_slots(calendar_id: str, date_str: str):
+    redis_client = get_redis()
+    if redis_client:
+        await redis_client.delete(f"slots:{calendar_id}:{date_str}")
+    else:
+        _slots_cache.pop((calendar_id, date_str), None)
+
+# --- TIME HELPERS ---
+def iso_to_epoch(s: str) -> int:
+    """
+    Converts an RFC 3339 timestamp (e.g. '2024-05-14T03:30:00Z' or '2024-05-14T09:00:00+05:30')
+    to POSIX seconds by slicing the fixed-width fields, without building a datetime.
+    """
+    seconds = calendar.timegm((int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]), 0, 0, 0))
+    offset = s[19:]
+    if offset.startswith('.'):
+        offset = offset.lstrip('.0123456789')
+    if offset in ('', 'Z', 'z'):
+        return seconds
+    sign = 1 if offset[0] == '+' else -1
+    return seconds - sign * (int(offset[1:3]) * 3600 + int(offset[4:6]) * 60)
+
+def free_slot_starts(slots: np.ndarray, busy_s: np.ndarray, busy_e: np.ndarray, slot_seconds: int) -> np.ndarray:
+    """
+    Returns the slot start times (POSIX seconds) whose [start, start + slot_seconds) window
+    overlaps none of the busy [busy_s, busy_e) intervals, testing every pair at once.
+    """
+    overlap = (slots[:, None] < busy_e) & (slots[:, None] + slot_seconds > busy_s)
+    return slots[~overlap.any(axis=1)]
 
 # --- BUSINESS LOGIC & TOOLS ---
 
@@ -38,24 +207,29 @@ def get_available_services() -> list:
     Returns a list of service dictionaries.
     """
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
+        config = get_config()
         return config.get('services', [])
     except Exception as e:
         return [{"error": f"Error reading services: {e}"}]
 
-def get_available_slots(date_str: str) -> list:
+async def get_available_slots(date_str: str) -> list:
     """
     Finds available booking slots for a given date.
     The date must be in 'YYYY-MM-DD' format.
     Returns a list of available time slots as strings (e.g., ["09:00", "10:00"]).
     """
+    calendar_id = os.getenv("GOOGLE_CALENDAR_ID", "primary")
     try:
-        creds = get_google_creds()
-        service = build("calendar", "v3", credentials=creds)
-        
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
+        cached_slots = await _get_cached_slots(calendar_id, date_str)
+    except Exception as e:
+        # The cache is optional; without it the calendar is simply queried every time
+        print(f"[ERROR] Could not read cached slots for {date_str}: {e}")
+        cached_slots = None
+    if cached_slots is not None:
+        return cached_slots
+
+    try:
+        config = get_config()
         
         business_hours = config['business_hours']
         start_hour, start_minute = map(int, business_hours['start'].split(':'))
@@ -63,98 +237,165 @@ def get_available_slots(date_str: str) -> list:
         
         target_date = datetime.strptime(date_str, "%Y-%m-%d")
         
-        time_min = datetime(target_date.year, target_date.month, target_date.day, start_hour, start_minute, tzinfo=timezone.utc).isoformat()
-        time_max = datetime(target_date.year, target_date.month, target_date.day, end_hour, end_minute, tzinfo=timezone.utc).isoformat()
-
-        events_result = service.events().list(
-            calendarId=os.getenv("GOOGLE_CALENDAR_ID", "primary"),
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True,
-            orderBy="startTime"
-        ).execute()
-        events = events_result.get("items", [])
-
-        busy_slots = []
-        for event in events:
-            start = datetime.fromisoformat(event['start']['dateTime'])
-            end = datetime.fromisoformat(event['end']['dateTime'])
-            busy_slots.append((start, end))
-
-        available_slots = []
-        slot_start_time = datetime(target_date.year, target_date.month, target_date.day, start_hour, start_minute)
-        slot_duration = timedelta(minutes=60) # Assume 60 min slots
-        
-        while slot_start_time.hour < end_hour:
-            slot_end_time = slot_start_time + slot_duration
-            is_busy = False
-            for busy_start, busy_end in busy_slots:
-                if max(slot_start_time.astimezone(timezone.utc), busy_start) < min(slot_end_time.astimezone(timezone.utc), busy_end):
-                    is_busy = True
-                    break
-            
-            if not is_busy:
-                available_slots.append(slot_start_time.strftime("%H:%M"))
-                
-            slot_start_time += slot_duration
+        # Business hours are in the business's timezone, not UTC or the host's local time
+        local_tz = get_local_tz()
+        day_start = datetime(target_date.year, target_date.month, target_date.day, start_hour, start_minute, tzinfo=local_tz)
+        day_end = datetime(target_date.year, target_date.month, target_date.day, end_hour, end_minute, tzinfo=local_tz)
+        time_min = day_start.isoformat()
+        time_max = day_end.isoformat()
+
+        # freebusy returns the merged busy intervals directly, rather than every event in the window
+        freebusy_result = await calendar_post("freeBusy", {
+            "timeMin": time_min,
+            "timeMax": time_max,
+            "timeZone": "UTC",
+            "items": [{"id": calendar_id}],
+        })
+        calendar_result = freebusy_result["calendars"][calendar_id]
+        if calendar_result.get("errors"):
+            # e.g. notFound for a wrong or unshared calendar id; its busy list is empty, not "all free"
+            reasons = ", ".join(error.get("reason", "unknown") for error in calendar_result["errors"])
+            raise RuntimeError(f"Calendar '{calendar_id}' could not be queried: {reasons}")
+        busy = calendar_result.get("busy", [])
+
+        slot_seconds = 60 * 60 # Assume 60 min slots
+        last_slot_limit = datetime(target_date.year, target_date.month, target_date.day, end_hour, tzinfo=local_tz)
+        slots = np.arange(day_start.timestamp(), last_slot_limit.timestamp(), slot_seconds, dtype=np.int64)
+        busy_s = np.array([iso_to_epoch(interval['start']) for interval in busy], dtype=np.int64)
+        busy_e = np.array([iso_to_epoch(interval['end']) for interval in busy], dtype=np.int64)
+        free = free_slot_starts(slots, busy_s, busy_e, slot_seconds)
+        available_slots = [datetime.fromtimestamp(t, tz=local_tz).strftime("%H:%M") for t in free.tolist()]
             
+        try:
+            await _set_cached_slots(calendar_id, date_str, available_slots)
+        except Exception as e:
+            print(f"[ERROR] Could not cache slots for {date_str}: {e}")
         return available_slots
 
     except Exception as e:
         return [{"error": f"Error getting slots: {e}"}]
 
 
-def book_appointment(service_name: str, date_str: str, time_str: str, user_name: str, user_email: str) -> str:
+async def create_calendar_event(service_name: str, date_str: str, time_str: str, user_name: str, user_email: str) -> str:
     """
-    Books an appointment. Returns a confirmation string.
+    Books an appointment by inserting it into the calendar. Returns a confirmation string.
     Use this only when all details (service, date, time, user name, and user email) are confirmed.
+    Logging to the sheet and the confirmation email are handled separately (see `log_to_sheet`
+    and `send_confirmation_email`) so they don't hold up the reply to the user.
+    Raises on failure.
     """
+    service_details = get_config()["_services_by_name"].get(service_name.casefold())
+    if not service_details:
+        raise ValueError(f"Service '{service_name}' not found.")
+    duration = service_details['duration_minutes']
+    
+    local_tz = get_local_tz()
+    naive_dt = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+    local_dt_start = naive_dt.replace(tzinfo=local_tz)
+    local_dt_end = local_dt_start + timedelta(minutes=duration)
+
+    event = {
+        "summary": f"{service_name} for {user_name}",
+        "start": {"dateTime": local_dt_start.isoformat(), "timeZone": local_tz.key},
+        "end": {"dateTime": local_dt_end.isoformat(), "timeZone": local_tz.key},
+        "attendees": [{"email": user_email}],
+    }
+    
+    calendar_id = os.getenv("GOOGLE_CALENDAR_ID", "primary")
+    await calendar_post(f"calendars/{quote(calendar_id, safe='')}/events", event)
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-        service_details = next((s for s in config['services'] if s['name'].lower() == service_name.lower()), None)
-        if not service_details:
-            return f"Error: Service '{service_name}' not found."
-        duration = service_details['duration_minutes']
-        
-        creds = get_google_creds()
-        
-        local_tz = pytz.timezone("Asia/Kolkata")
-        naive_dt = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-        local_dt_start = local_tz.localize(naive_dt)
-        local_dt_end = local_dt_start + timedelta(minutes=duration)
-
-        event = {
-            "summary": f"{service_name} for {user_name}",
-            "start": {"dateTime": local_dt_start.isoformat(), "timeZone": str(local_tz)},
-            "end": {"dateTime": local_dt_end.isoformat(), "timeZone": str(local_tz)},
-            "attendees": [{"email": user_email}],
-        }
-        
-        calendar_service = build("calendar", "v3", credentials=creds)
-        created_event = calendar_service.events().insert(calendarId=os.getenv("GOOGLE_CALENDAR_ID", "primary"), body=event).execute()
+        await _drop_cached_slots(calendar_id, date_str)
+    except Exception as e:
+        # The event is already booked; a stale cache entry just expires on its own
+        print(f"[ERROR] Could not clear cached slots for {date_str}: {e}")
 
-        # --- CODE CORRECTION HERE ---
-        # Use gspread.authorize() for OAuth credentials instead of service_account()
-        gc = gspread.authorize(creds)
-        # --- END CORRECTION ---
+    return f"Appointment confirmed for {service_name} on {date_str} at {time_str}. A confirmation email will be sent shortly."
 
-        spreadsheet = gc.open_by_url(os.environ["GOOGLE_SHEET_URL"])
-        worksheet = spreadsheet.sheet1
-        worksheet.append_row([datetime.now().isoformat(), user_name, user_email, service_name, date_str, time_str])
+def log_to_sheet(service_name: str, date_str: str, time_str: str, user_name: str, user_email: str):
+    """Queues the booking for the Google Sheet; `sheet_writer` appends queued rows in batches."""
+    _sheet_queue.put_nowait([datetime.now().isoformat(), user_name, user_email, service_name, date_str, time_str])
 
-        send_confirmation_email(user_email, user_name, service_name, date_str, time_str)
-        
-        return f"Appointment confirmed for {service_name} on {date_str} at {time_str}. A confirmation email has been sent."
+async def _append_rows(rows: list):
+    # gspread_asyncio wraps gspread with the same OAuth credentials used for the calendar
+    agc = await get_gspread_manager().authorize()
+    spreadsheet = await agc.open_by_url(os.environ["GOOGLE_SHEET_URL"])
+    worksheet = await spreadsheet.get_worksheet(0)
+    await worksheet.append_rows(rows, value_input_option="RAW")
 
-    except Exception as e:
-        return f"Error booking appointment: {e}"
+async def sheet_writer():
+    """
+    Background task that drains the sheet queue. Rows are collected until
+    SHEET_BATCH_SIZE is reached or SHEET_FLUSH_SECONDS have passed since the
+    first one, then written with a single append_rows request.
+    Returns once `stop_sheet_writer` is called, after writing what is left.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        row = await _sheet_queue.get()
+        if row is None:
+            break
+        rows = [row]
+        deadline = loop.time() + SHEET_FLUSH_SECONDS
+        while len(rows) < SHEET_BATCH_SIZE:
+            try:
+                row = await asyncio.wait_for(_sheet_queue.get(), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            if row is None:
+                stopping = True
+                break
+            rows.append(row)
+        await _write_batch(rows)
+
+async def _write_batch(rows: list):
+    # Quota errors (429) are the usual failure, so back off and retry before giving up.
+    # Once shutdown has begun there is no time left to back off (gunicorn kills the worker after its
+    # graceful_timeout), so a pending wait is cut short and the batch gets one last attempt.
+    for attempt in range(SHEET_WRITE_ATTEMPTS):
+        try:
+            await _append_rows(rows)
+            return
+        except Exception as e:
+            print(f"Failed to log {len(rows)} booking(s) to sheet (attempt {attempt + 1}/{SHEET_WRITE_ATTEMPTS}): {e}")
+            if attempt + 1 == SHEET_WRITE_ATTEMPTS or _sheet_stopping.is_set():
+                break
+            try:
+                await asyncio.wait_for(_sheet_stopping.wait(), timeout=SHEET_RETRY_BASE_SECONDS * 2 ** attempt)
+            except asyncio.TimeoutError:
+                pass
+    # Print the rows themselves so they can be added to the sheet by hand
+    for row in rows:
+        print(f"[ERROR] Dropped sheet row: {orjson.dumps(row).decode()}")
+
+def stop_sheet_writer():
+    _sheet_stopping.set()
+    _sheet_queue.put_nowait(None)
+
+# --- EMAIL ---
+# One logged-in SMTP connection is reused across emails to skip the TLS and auth handshakes.
+# It can only carry one message at a time, hence the lock.
+_smtp = {"conn": None}
+_smtp_lock = asyncio.Lock()
+
+async def _get_smtp(sender_email: str, sender_password: str) -> aiosmtplib.SMTP:
+    conn = _smtp["conn"]
+    if conn is None or not conn.is_connected:
+        conn = aiosmtplib.SMTP(hostname='smtp.gmail.com', port=465, use_tls=True)
+        await conn.connect()
+        await conn.login(sender_email, sender_password)
+        _smtp["conn"] = conn
+    return conn
+
+async def close_smtp():
+    conn, _smtp["conn"] = _smtp["conn"], None
+    if conn is not None and conn.is_connected:
+        await conn.quit()
 
-def send_confirmation_email(recipient_email, user_name, service_name, date_str, time_str):
-    # Helper function, no changes needed
+async def send_confirmation_email(recipient_email, user_name, service_name, date_str, time_str):
     sender_email = os.environ["SENDER_EMAIL"]
     sender_password = os.environ["SENDER_PASSWORD"]
-    with open(CONFIG_FILE, 'r') as f: config = json.load(f)
+    config = get_config()
     business_name = config['business_name']
     subject = f"Booking Confirmation from {business_name}"
     body = f"Hi {user_name},\n\nThis is a confirmation for your appointment.\n\nService: {service_name}\nDate: {date_str}\nTime: {time_str}\n\nWe look forward to seeing you!\n\nBest,\nThe {business_name} Team"
@@ -163,8 +404,14 @@ def send_confirmation_email(recipient_email, user_name, service_name, date_str,
     msg['From'] = sender_email
     msg['To'] = recipient_email
     try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp_server:
-            smtp_server.login(sender_email, sender_password)
-            smtp_server.sendmail(sender_email, recipient_email, msg.as_string())
+        async with _smtp_lock:
+            smtp = await _get_smtp(sender_email, sender_password)
+            try:
+                await smtp.send_message(msg)
+            except aiosmtplib.SMTPServerDisconnected:
+                # The server closes idle connections; reconnect once and retry
+                _smtp["conn"] = None
+                smtp = await _get_smtp(sender_email, sender_password)
+                await smtp.send_message(msg)
     except Exception as e:
         print(f"Failed to send email: {e}")
\ No newline at end of file
@@ -1,5 +1,4 @@
 import React, { useState, useEffect, useRef } from 'react';
-import axios from 'axios';
 import Calendar from 'react-calendar';
 import 'react-calendar/dist/Calendar.css';
 import './App.css';
@@ -14,8 +13,6 @@ function App() {
   const messageListRef = useRef(null);
 
   useEffect(() => {
-    const initialSessionId = `session_${Date.now()}`;
-    setSessionId(initialSessionId);
     setMessages([{ 
       type: 'text',
       sender: 'ai', 
@@ -38,13 +35,50 @@ function App() {
     setIsLoading(true);
 
     try {
-      const response = await axios.post(API_URL, {
-        messages: newMessages.map(({sender, text}) => ({sender, text})),
-        session_id: sessionId,
+      const response = await fetch(API_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        // The backend keeps the conversation history per session; only the new message is sent.
+        // The session id is issued by the backend on the first reply (null starts a new session).
+        body: JSON.stringify({
+          session_id: sessionId,
+          new_message: messageText,
+        }),
       });
+      if (!response.ok) throw new Error(`Request failed with status ${response.status}`);
 
-      const aiMessage = { sender: 'ai', ...response.data };
-      setMessages(prev => [...prev, aiMessage]);
+      if (response.headers.get('content-type')?.startsWith('text/event-stream')) {
+        // Free-form replies arrive as server-sent events; append each delta as it comes in
+        setMessages(prev => [...prev, { type: 'text', sender: 'ai', text: '' }]);
+        const appendToReply = (delta) => setMessages(prev => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, text: last.text + delta }];
+        });
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split('\n\n');
+          buffer = events.pop();
+          for (const event of events) {
+            if (!event.startsWith('data: ')) continue;
+            const { session_id, delta, reply, error } = JSON.parse(event.slice(6));
+            if (session_id) setSessionId(session_id);
+            if (error) throw new Error(error);
+            if (delta) appendToReply(delta);
+            // A tool the model called after its text (e.g. slot options) arrives as a whole message
+            if (reply) setMessages(prev => [...prev, { sender: 'ai', ...reply }]);
+          }
+        }
+      } else {
+        const { session_id, ...data } = await response.json();
+        setSessionId(session_id);
+        setMessages(prev => [...prev, { sender: 'ai', ...data }]);
+      }
 
     } catch (error) {
       console.error('Error fetching response:', error);